@@ -16,17 +16,27 @@ i.e. .build and .tx will not be included in the zip.
 
 import os
 import re
+import shutil
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
 from glob import glob
 from subprocess import PIPE, Popen
-from typing import Tuple, Union
+from typing import List, Tuple, Union
 
 CALIBRE_CONFIG_DIRECTORY = os.environ.get(
     'CALIBRE_CONFIG_DIRECTORY',
-    os.path.join(os.environ.get('appdata'), 'calibre'),
+    os.path.join(os.environ.get('appdata', ''), 'calibre'),
 )
 PLUGINS_DIRECTORY = os.path.join(CALIBRE_CONFIG_DIRECTORY, 'plugins')
 
+# the scripts are always run from the plugin folder
+CWD = os.getcwd()
+
+_NAME_RE = re.compile(r"\s+name\s*=\s*'([^']*)'")
+_VERSION_RE = re.compile(r'\s+version\s*=\s*\(([^)]*)\)')
+_DIGITS_RE = re.compile(r'\d+')
+
 def get_calibre_bin(calibre_bin: str) -> str:
     return os.path.join(os.environ.get('CALIBRE_DIRECTORY', ''), calibre_bin)
 
@@ -35,57 +45,155 @@ def run_command(command_line: Union[list, str], wait=False) -> Popen:
     Lauch a command line and return the subprocess
     
     :param command_line:    command line to execute
+                            a list is passed directly to the program, a str is run through the shell
     :param wait:            Wait for the file to be closed
     :return:                The subprocess returned by the Popen call
     """
     
-    if not isinstance(command_line, str):
-        for idx in range(len(command_line)):
-            if ' ' in command_line[idx]:
-                command_line[idx] = '"'+command_line[idx]+'"'
-        command_line = ' '.join(command_line)
-    
-    subproc = Popen(command_line, stdout=PIPE, stderr=PIPE, shell=True)
+    shell = isinstance(command_line, str)
+    subproc = Popen(command_line, stdout=PIPE, stderr=PIPE, shell=shell)
     if wait:
         subproc.wait()
     return subproc
 
-def read_plugin_name() -> Tuple[str, str]:
-    init_file = os.path.join(os.getcwd(), '__init__.py')
-    if not os.path.exists(init_file):
-        print('ERROR: No __init__.py file found for this plugin')
-        raise FileNotFoundError(init_file)
+def read_plugin_init(init_file: str) -> Tuple[str, str]:
+    """
+    Read the name and the version of the plugin in its __init__.py
     
-    zip_file_name = None
+    :param init_file:       path of the __init__.py
+    :return:                (name, version)
+    """
+    
+    version = None
     with open(init_file) as file:
         content = file.read()
-        name_matches = re.findall(r"\s+name\s*=\s*\'([^\']*)\'", content)
-        if name_matches:
-            name = name_matches[0]
-            zip_file_name = name+'.zip'
+        name_match = _NAME_RE.search(content)
+        if name_match:
+            name = name_match.group(1)
         else:
             raise RuntimeError('Could not find plugin name in __init__.py')
-        version_matches = re.findall(r'\s+version\s*=\s*\(([^\)]*)\)', content)
-        if version_matches:
-            version = '.'.join(re.findall(r'\d+', version_matches[0]))
+        version_match = _VERSION_RE.search(content)
+        if version_match:
+            version = '.'.join(_DIGITS_RE.findall(version_match.group(1)))
+    
+    return name, version
+
+def read_plugin_name() -> Tuple[str, str]:
+    init_file = os.path.join(CWD, '__init__.py')
+    if not os.path.exists(init_file):
+        print('ERROR: No __init__.py file found for this plugin')
+        raise FileNotFoundError(init_file)
+    
+    name, version = read_plugin_init(init_file)
+    zip_file_name = name+'.zip'
     
     print(f'Plugin \'{name}\' v{version} will be zipped to: "{zip_file_name}"')
     return zip_file_name, version
 
+def is_translation_outdated(po: str) -> bool:
+    'Test if the .mo compiled from this .po is missing or older'
+    mo = os.path.splitext(po)[0]+'.mo'
+    try:
+        return os.path.getmtime(mo) < os.path.getmtime(po)
+    except OSError:
+        return True
+
+def compile_translation(po: str):
+    'Compile a .po to its .mo, raise if calibre-debug fails'
+    subproc = run_command([
+        get_calibre_bin('calibre-debug'),
+        '-c',
+        'from calibre.translations.msgfmt import main; main()',
+        os.path.abspath(po),
+    ])
+    # communicate() read the pipes while waiting, a full pipe can't block the process
+    _, stderr = subproc.communicate()
+    if subproc.returncode:
+        error = stderr.decode('utf-8', errors='replace').strip()
+        raise RuntimeError(f'Failed to compile the translation "{po}" (exit code {subproc.returncode}): {error}')
+
 def update_translations():
-    for po in glob('translations/**/*.po', recursive=True):
-        run_command([
-            get_calibre_bin('calibre-debug'),
-            '-c',
-            'from calibre.translations.msgfmt import main; main()',
-            os.path.abspath(po),
-        ], wait=True)
+    # each .po is compiled by its own calibre-debug process, run them in parallel
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        futures = [
+            executor.submit(compile_translation, po)
+            for po in glob('translations/**/*.po', recursive=True)
+            if is_translation_outdated(po)
+        ]
+        # raise the first error of the workers, the build must not go on with stale .mo
+        for future in futures:
+            future.result()
+
+# files included anywhere in the plugin folder
+ZIP_EXTENSIONS = {'.py', '.ui', '.md', '.html', '.cmd'}
+ZIP_NAMES = {os.path.normcase(n) for n in ['LICENSE', 'CREDITS']}
+# files included only inside a specific subfolder
+ZIP_FOLDER_EXTENSIONS = {
+    'images': {'.png'},  # recursive
+    'translations': {'.pot', '.mo', '.po'},  # only the direct children
+}
+
+def list_plugin_files() -> List[str]:
+    """
+    Retrieve the files to include in the plugin zip, with a single walk of the plugin folder
+    
+    Subfolders and files prefixed with '.' are ignored.
+    """
+    
+    rslt = []
+    for dirpath, dirnames, filenames in os.walk('.', followlinks=True):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        dirpath = dirpath[2:]  # remove the leading './'
+        norm_dirpath = os.path.normcase(dirpath)
+        top_dir = norm_dirpath.split(os.sep, 1)[0]
+        folder_extensions = ZIP_FOLDER_EXTENSIONS.get(top_dir, ())
+        if top_dir == 'translations' and norm_dirpath != top_dir:
+            folder_extensions = ()
+        
+        for name in sorted(filenames):
+            if name.startswith('.'):
+                continue
+            
+            norm_name = os.path.normcase(name)
+            ext = os.path.splitext(norm_name)[1]
+            if (
+                ext in ZIP_EXTENSIONS
+                or ext in folder_extensions
+                or norm_name in ZIP_NAMES
+                or not dirpath and fnmatch(name, 'plugin-import-name-*.txt')
+            ):
+                rslt.append(os.path.join(dirpath, name))
+    
+    return rslt
+
+ZIP_COPY_BUFFER = 1<<20
+ZIP_SMALL_FILE = 1<<14
 
 def create_zip_file(filename, mode, files):
-    with zipfile.ZipFile(filename, mode, zipfile.ZIP_STORED) as zip:
-        for file in files:
-            if os.path.isfile(file):
-                zip.write(file, file)
+    if mode not in ('w', 'x'):
+        # append need to read the existing archive, can't use a write only buffer
+        with zipfile.ZipFile(filename, mode, zipfile.ZIP_STORED) as zip:
+            _write_zip_files(zip, files)
+        return
+    
+    # buffer the output, zipfile emit many small writes for each entry (header, name, data, footer)
+    with open(filename, mode+'b', buffering=ZIP_COPY_BUFFER) as file:
+        with zipfile.ZipFile(file, mode, zipfile.ZIP_STORED) as zip:
+            _write_zip_files(zip, files)
+
+def _write_zip_files(zip: zipfile.ZipFile, files):
+    for file in files:
+        if not os.path.isfile(file):
+            continue
+        zinfo = zipfile.ZipInfo.from_file(file, file)
+        zinfo.compress_type = zipfile.ZIP_STORED
+        if zinfo.file_size < ZIP_SMALL_FILE:
+            # read small files in one go
+            with open(file, 'rb') as src:
+                zip.writestr(zinfo, src.read())
+        else:
+            with open(file, 'rb') as src, zip.open(zinfo, 'w') as dest:
+                shutil.copyfileobj(src, dest, ZIP_COPY_BUFFER)
 
 def build_plugin():
     
@@ -93,30 +201,15 @@ def build_plugin():
     
     update_translations()
     
-    files = []
-    files.extend(glob('plugin-import-name-*.txt'))
-    files.extend(glob('**/*.py', recursive=True))
-    files.extend(glob('**/*.ui', recursive=True))
-    files.extend(glob('images/**/*.png', recursive=True))
-    files.extend(glob('translations/*.pot'))
-    files.extend(glob('translations/*.mo'))
-    files.extend(glob('translations/*.po'))
-    files.extend(glob('**/*.md', recursive=True))
-    files.extend(glob('**/*.html', recursive=True))
-    files.extend(glob('**/*.cmd', recursive=True))
-    files.extend(glob('**/LICENSE', recursive=True))
-    files.extend(glob('**/CREDITS', recursive=True))
+    files = list_plugin_files()
     
     create_zip_file(PLUGIN, 'w', files)
     
     run_command([get_calibre_bin('calibre-customize'), '-a', PLUGIN], wait=True)
     
-    versioning = os.path.join(os.getcwd(), '-- versioning')
+    versioning = os.path.join(CWD, '-- versioning')
     os.makedirs(versioning, exist_ok=True)
-    out = os.path.join(versioning, PLUGIN)
-    if os.path.exists(out):
-        os.remove(out)
-    os.rename(PLUGIN, out)
+    os.replace(PLUGIN, os.path.join(versioning, PLUGIN))
     
     print(f"Plugin '{PLUGIN}' build with succes.")
 
@@ -12,108 +12,184 @@ Invocation should be via each plugin release.cmd, which will ensure that:
 - Pass through the CALIBRE_GITHUB_TOKEN environment variable value
 """
 
-import configparser
 import json
 import os
 import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import client
 from subprocess import PIPE, Popen
-from typing import Tuple, Union
+from typing import Dict, List, Tuple, Union
 from urllib import error, parse, request
 
+from build import read_plugin_init
+
+# the scripts are always run from the plugin folder
+CWD = os.getcwd()
+
+# applied in this order, the bold italic before the bold before the italic
+_MD_EMPHASIS = (
+    (re.compile(r'\*\*\*(.+?)\*\*\*'), r'[B][I]\1[/I][/B]'),
+    (re.compile(r'\*\*(.+?)\*\*'), r'[B]\1[/B]'),
+    (re.compile(r'\*(.+?)\*'), r'[I]\1[/I]'),
+)
+_LIST_RE = re.compile(r'\s*- ')
 
 def read_repos_detail() -> str:
-    config = configparser.ConfigParser()
-    config.read(os.path.join(os.getcwd(), '.git','config'))
-    origin = None
-    for section in ['remote "origin"', "remote 'origin'"]:
-        if section in config:
-            origin = config.get(section, 'url')
+    # git give directly the url, without parsing the whole config file
+    subproc = run_command(['git', 'config', '--get', 'remote.origin.url'])
+    origin = subproc.communicate()[0].decode('utf-8').strip()
     if not origin:
-        RuntimeError('Could not find the git repository')
+        raise RuntimeError('Could not find the git repository')
     
     return origin[len('https://github.com/'):-len('.git')]
 
 def read_plugin_details() -> Tuple[str, str, str]:
-    short_name = os.path.split(os.getcwd())[1]
-    initFile = os.path.join(os.getcwd(), '__init__.py')
+    short_name = os.path.split(CWD)[1]
+    initFile = os.path.join(CWD, '__init__.py')
     if not os.path.exists(initFile):
         print('ERROR: No __init__.py file found for this plugin')
         raise FileNotFoundError(initFile)
     
-    plugin_name = None
-    with open(initFile) as file:
-        content = file.read()
-        nameMatches = re.findall(r"\s+name\s*=\s*\'([^\']*)\'", content)
-        if nameMatches:
-            plugin_name = nameMatches[0]
-        else:
-            raise RuntimeError('Could not find plugin name in __init__.py')
-        versionMatches = re.findall(r"\s+version\s*=\s*\(([^\)]*)\)", content)
-        if versionMatches:
-            version = versionMatches[0].replace(',','.').replace(' ','')
-
+    plugin_name, version = read_plugin_init(initFile)
+    
     print(f"Plugin to be released for: '{plugin_name}' v{version}")
     return short_name, plugin_name, version
 
 def get_plugin_zip_path(plugin_name: str) -> str:
-    zip_file = os.path.join(os.getcwd(), '-- versioning', plugin_name+'.zip')
+    zip_file = os.path.join(CWD, '-- versioning', plugin_name+'.zip')
     if not os.path.exists(zip_file):
         print(f'ERROR: No zip file found for this plugin at: {zip_file}')
         raise FileNotFoundError(zip_file)
     return zip_file
 
 def read_change_log_for_version(version: str) -> str:
-    changeLogFile = os.path.join(os.getcwd(), 'changelog.md')
+    changeLogFile = os.path.join(CWD, 'changelog.md')
     if not os.path.exists(changeLogFile):
         print(f'ERROR: No change log found for this plugin at: {changeLogFile}')
         raise FileNotFoundError(changeLogFile)
     
-    with open(changeLogFile) as file:
-        content = file.readlines()
-    
+    versionHeader = f'## [{version}]'
     foundVersion = False
-    changeLines = []
-    for line in content:
-        if not foundVersion:
-            if line.startswith(f'## [{version}]'):
-                foundVersion = True
-            continue
-        # We are within the current version - include content unless we hit the previous version
-        if line.startswith('## ['):
-            break
-        changeLines.append(line.rstrip())
+    changeLines = deque()
+    with open(changeLogFile) as file:
+        for line in file:
+            if not foundVersion:
+                if line.startswith(versionHeader):
+                    foundVersion = True
+                continue
+            # We are within the current version - include content unless we hit the previous version
+            if line.startswith('## ['):
+                break
+            changeLines.append(line.rstrip())
 
     if len(changeLines) == 0:
         print(f'ERROR: No change log details found for this version: {version}')
         raise RuntimeError('Missing details in changelog')
 
     # Trim trailing blank lines (start/end)
-    for idx in [0, -1]:
-        while changeLines and len(changeLines[idx].strip()) == 0:
-            changeLines.pop(idx)
+    while changeLines and not changeLines[0].strip():
+        changeLines.popleft()
+    while changeLines and not changeLines[-1].strip():
+        changeLines.pop()
 
     print(f'ChangeLog details found: {len(changeLines):d} lines')
     return '\n'.join(changeLines)
 
-def check_if_release_exists(api_repo_url: str, api_token: str, tag_name: str):
+class GitHubSession:
+    """
+    Minimal HTTP session for the GitHub API
+    
+    The connection to each host is kept alive between the requests,
+    and the common headers are set only once.
+    The proxy of the environment (HTTPS_PROXY...) is used,
+    the redirections are not followed and are raised as a HTTPError.
+    """
+    
+    def __init__(self, api_token: str):
+        self.headers = {
+            'accept': 'application/vnd.github+json',
+            'Authorization': f'BEARER {api_token}',
+            'User-Agent': 'common_utils-release',
+        }
+        self._connections = {}
+    
+    def _connection(self, url: parse.SplitResult) -> Tuple[client.HTTPConnection, bool]:
+        """
+        Get the connection to the host of the url
+        
+        :return:                (connection, True if the connection has already been used)
+        """
+        
+        if url.netloc in self._connections:
+            return self._connections[url.netloc], True
+        
+        conn_class = client.HTTPSConnection if url.scheme == 'https' else client.HTTPConnection
+        proxy = request.getproxies().get(url.scheme, None)
+        if proxy and not request.proxy_bypass(url.hostname):
+            # connect to the proxy, and open a tunnel to the host through it
+            proxy = parse.urlsplit(proxy if '://' in proxy else 'http://'+proxy)
+            conn = conn_class(proxy.hostname, proxy.port or 80)
+            conn.set_tunnel(url.hostname, url.port)
+        else:
+            conn = conn_class(url.hostname, url.port)
+        
+        self._connections[url.netloc] = conn
+        return conn, False
+    
+    def request(self, method: str, url: str, body=None, headers: Dict[str, str]=None) -> bytes:
+        """
+        Send a request and return the body of the response
+        
+        :raise HTTPError: for any status code other than 2xx
+        """
+        
+        split_url = parse.urlsplit(url)
+        path = split_url.path + ('?'+split_url.query if split_url.query else '')
+        headers = {**self.headers, **(headers or {})}
+        
+        while True:
+            conn, reused = self._connection(split_url)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                break
+            except (client.RemoteDisconnected, ConnectionError):
+                conn.close()
+                del self._connections[split_url.netloc]
+                # the server may have closed the kept alive connection, retry once with a new one,
+                # but never a POST: it may have been received and would be done twice
+                if not reused or method == 'POST':
+                    raise
+                if hasattr(body, 'seek'):
+                    body.seek(0)
+        
+        content = response.read()
+        if not 200 <= response.status < 300:
+            raise error.HTTPError(url, response.status, response.reason, response.headers, None)
+        return content
+    
+    def close(self):
+        for conn in self._connections.values():
+            conn.close()
+        self._connections.clear()
+
+def check_if_release_exists(session: GitHubSession, api_repo_url: str, tag_name: str):
     # If we have already released this plugin version then we have a problem
     # Most likely have forgotten to bump the version number?
     endpoint = api_repo_url + '/releases/tags/' + tag_name
-    req = request.Request(url=endpoint, method='GET')
-    req.add_header('accept', 'application/vnd.github+json')
-    req.add_header('Authorization', f'BEARER {api_token}')
     try:
         print(f'Checking if GitHub tag exists: {endpoint}')
-        with request.urlopen(req) as response:
-            response = response.read().decode('utf-8')
-            raise RuntimeError('Release for this version already exists. Do you need to bump version?')
+        # only the status is needed, HEAD avoid to download the release details
+        session.request('HEAD', endpoint)
     except error.HTTPError as e:
         if e.code == 404:
             print('Existing release for this version not found, OK to proceed')
-        else:
-            raise RuntimeError('Failed to check release existing API due to:',e)
+            return
+        raise RuntimeError('Failed to check release existing API due to:',e)
+    raise RuntimeError('Release for this version already exists. Do you need to bump version?')
 
-def create_GitHub_release(api_repo_url: str, api_token: str, plugin_name: str, tag_name: str, changeBody: str):
+def create_GitHub_release(session: GitHubSession, api_repo_url: str, plugin_name: str, tag_name: str, changeBody: str):
     endpoint = api_repo_url + '/releases'
     data = {
         'tag_name': tag_name,
@@ -126,69 +202,78 @@ def create_GitHub_release(api_repo_url: str, api_token: str, plugin_name: str, t
     }
     data = json.dumps(data)
     data = data.encode()
-    req = request.Request(url=endpoint, data=data, method='POST')
-    req.add_header('accept', 'application/vnd.github+json')
-    req.add_header('Authorization', f'BEARER {api_token}')
-    req.add_header('Content-Type', 'application/json')
     try:
         print(f'Creating release: {endpoint}')
-        with request.urlopen(req) as response:
-            response = response.read().decode('utf-8')
-            content = json.loads(response)
-            htmlUrl = content['html_url']
-            upload_url = content['upload_url']
-            return (htmlUrl, upload_url)
+        response = session.request('POST', endpoint, body=data, headers={'Content-Type': 'application/json'})
+        content = json.loads(response.decode('utf-8'))
+        htmlUrl = content['html_url']
+        upload_url = content['upload_url']
+        return (htmlUrl, upload_url)
     except error.HTTPError as e:
         raise RuntimeError('Failed to create release due to:',e)
 
-def upload_zip_to_release(api_token: str, upload_url: str, zip_file: str, tag_name: str):
+def upload_zip_to_release(session: GitHubSession, upload_url: str, zip_file: str, tag_name: str):
     dst = os.path.splitext(zip_file)[0] +'-'+tag_name+'.zip'
     os.rename(zip_file, dst)
     zip_file = dst
     zip_file_up = parse.quote(os.path.basename(zip_file))
     
     endpoint = upload_url.replace('{?name,label}', f'?name={zip_file_up}&label={zip_file_up}')
+    # the file object is sent by blocks, the zip is never fully loaded in memory
     with open(zip_file, 'rb') as file:
-        content = file.read()
-    
-    req = request.Request(url=endpoint, data=content, method='POST')
-    req.add_header('accept', 'application/vnd.github+json')
-    req.add_header('Authorization', f'BEARER {api_token}')
-    req.add_header('Content-Type', 'application/octet-stream')
-    try:
-        print(f'Uploading zip for release: {endpoint}')
-        with request.urlopen(req) as response:
-            response = response.read().decode('utf-8')
-            content = json.loads(response)
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'Content-Length': str(os.fstat(file.fileno()).st_size),
+        }
+        try:
+            print(f'Uploading zip for release: {endpoint}')
+            response = session.request('POST', endpoint, body=file, headers=headers)
+            content = json.loads(response.decode('utf-8'))
             downloadUrl = content['browser_download_url']
             print(f'Zip uploaded successfully: {downloadUrl}')
-    except error.HTTPError as e:
-        raise RuntimeError('Failed to upload zip due to:',e)
+        except error.HTTPError as e:
+            raise RuntimeError('Failed to upload zip due to:',e)
 
 def run_command(command_line: Union[list, str], wait=False) -> Popen:
     """
     Lauch a command line and return the subprocess
     
     :param command_line:    command line to execute
+                            a list is passed directly to the program, a str is run through the shell
     :param wait:            Wait for the file to be closed
     :return:                The subprocess returned by the Popen call
     """
     
-    if not isinstance(command_line, str):
-        for idx in range(len(command_line)):
-            if ' ' in command_line[idx]:
-                command_line[idx] = '"'+command_line[idx]+'"'
-        command_line = ' '.join(command_line)
-    
-    subproc = Popen(command_line, stdout=PIPE, stderr=PIPE, shell=True)
+    shell = isinstance(command_line, str)
+    subproc = Popen(command_line, stdout=PIPE, stderr=PIPE, shell=shell)
     if wait:
         subproc.wait()
     return subproc
 
 
+class _BBListState:
+    'nesting state of the bbcode [LIST] while converting the changelog'
+    
+    def __init__(self):
+        # indentation prefix of each opened list
+        self.prefixes = []
+    
+    def open(self, changelog: List[str], prefix: str):
+        # close the deeper lists, possibly many levels at once
+        while self.prefixes and len(self.prefixes[-1]) > len(prefix):
+            self.prefixes.pop()
+            changelog.append('[/LIST]')
+        if not self.prefixes or len(self.prefixes[-1]) < len(prefix):
+            self.prefixes.append(prefix)
+            changelog.append('[LIST]')
+    
+    def close(self, changelog: List[str]):
+        changelog.extend(['[/LIST]'] * len(self.prefixes))
+        self.prefixes.clear()
+
 def build_MobileRead_post():
     output_file = 'MobileRead_post.bbcode'
-    MobileRead_body = os.path.join(os.getcwd(), 'readme.bbcode')
+    MobileRead_body = os.path.join(CWD, 'readme.bbcode')
     if not os.path.exists(MobileRead_body):
         print(f'Creating {output_file} aborted: no body found')
         return
@@ -196,68 +281,50 @@ def build_MobileRead_post():
     with open(MobileRead_body) as f:
         MobileRead_body = f.read().strip()
     
-    with open(os.path.join(os.getcwd(), 'changelog.md')) as f:
+    with open(os.path.join(CWD, 'changelog.md')) as f:
         changelog_src = f.read().strip().splitlines()
     
     changelog = []
-    global bb_list_level, list_prefix_last
-    bb_list_level = 0
-    list_prefix_last = None
+    list_state = _BBListState()
     
     def md2bb(line):
         line = line.replace('`', '')
         line = line.replace('<br>', '\n')
-        line = re.sub(r'\*\*\*(.+?)\*\*\*', r'[B][I]\1[/I][/B]', line)
-        line = re.sub(r'\*\*(.+?)\*\*', r'[B]\1[/B]', line)
-        line = re.sub(r'\*(.+?)\*', r'[I]\1[/I]', line)
+        for pattern, repl in _MD_EMPHASIS:
+            line = pattern.sub(repl, line)
         
         return line
     
-    def bb_list_close():
-        global bb_list_level, list_prefix_last
-        for idx in range(bb_list_level):
-            changelog.append('[/LIST]')
-        bb_list_level = 0
-        list_prefix_last = None
-    
     for line in changelog_src:
         
         if line.startswith('# '):
             pass
         
         if line.startswith('## '):
-            bb_list_close()
+            list_state.close(changelog)
             line = line.replace('#', '').replace('[', '').replace(']', '').strip()
             changelog.append('\n[B]version '+line+'[/B]')
         
         if line.startswith('### '):
-            bb_list_close()
+            list_state.close(changelog)
             changelog.append(line.replace('#', '').strip())
         
-        if re.match(r'\s*- ', line):
-            list_prefix = line.split('-', maxsplit=1)[0]
-            if list_prefix != list_prefix_last:
-                if list_prefix_last is None or len(list_prefix_last) < len(list_prefix):
-                    bb_list_level += 1
-                    changelog.append('[LIST]')
-                elif len(list_prefix_last) == len(list_prefix):
-                    pass
-                elif len(list_prefix_last) > len(list_prefix):
-                    bb_list_level -= 1
-                    changelog.append('[/LIST]')
-                
-                list_prefix_last = list_prefix
+        if _LIST_RE.match(line):
+            list_state.open(changelog, line.split('-', maxsplit=1)[0])
             
             line = line.strip().removeprefix('- ')
             changelog.append('[*]'+md2bb(line))
     
-    bb_list_close()
+    list_state.close(changelog)
     
     
+    post = ''.join([
+        MobileRead_body,
+        '\n\n[B]Version History:[/B]\n',
+        '[SPOILER]', '\n'.join(changelog).strip(), '[/SPOILER]',
+    ])
     with open(output_file, 'w', newline='\n') as f:
-        f.write(MobileRead_body)
-        f.write('\n\n[B]Version History:[/B]\n')
-        f.write('[SPOILER]'+'\n'.join(changelog).strip()+'[/SPOILER]')
+        f.write(post)
     
     print(f'{output_file} builded')
 
@@ -276,14 +343,22 @@ if __name__=="__main__":
         raise RuntimeError('This is a test/experimental version. Aborted.')
     tag_name = version
     
-    check_if_release_exists(api_repo_url, api_token, tag_name)
-    
-    zip_file = get_plugin_zip_path(plugin_name)
+    session = GitHubSession(api_token)
     
-    changeBody = read_change_log_for_version(version)
+    # the release check run in background while the local files are read
+    # the session is used only by this thread until the result is retrieved
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        release_check = executor.submit(check_if_release_exists, session, api_repo_url, tag_name)
+        
+        zip_file = get_plugin_zip_path(plugin_name)
+        
+        changeBody = read_change_log_for_version(version)
+        
+        release_check.result()
     
-    html_url, upload_url = create_GitHub_release(api_repo_url, api_token, plugin_name, tag_name, changeBody)
-    upload_zip_to_release(api_token, upload_url, zip_file, tag_name)
+    html_url, upload_url = create_GitHub_release(session, api_repo_url, plugin_name, tag_name, changeBody)
+    upload_zip_to_release(session, upload_url, zip_file, tag_name)
+    session.close()
     print('Github release completed:', html_url)
     run_command('git pull --tags')
     
@@ -11,12 +11,15 @@ except NameError:
 
 import copy
 import os
+import threading
+from collections import Counter
+from functools import lru_cache
 from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
 try:
-    from qt.core import QApplication, QIcon, QPixmap
+    from qt.core import QApplication, QIcon, QPixmap, QPixmapCache, QThread, QTimer
 except ImportError:
-    from PyQt5.Qt import QApplication, QIcon, QPixmap
+    from PyQt5.Qt import QApplication, QIcon, QPixmap, QPixmapCache, QThread, QTimer
 
 from calibre import prints
 from calibre.constants import DEBUG, iswindows
@@ -45,17 +48,24 @@ def get_plugin_attribut(name: str, default=None):
     
     global PLUGIN_CLASSE
     if not PLUGIN_CLASSE:
-        import importlib
+        # the class is searched only once, the result is kept for the next calls
+        import sys
         
         from calibre.customize import Plugin
         
-        plugin_classes = []
-        for obj in importlib.import_module('.'.join(__name__.split('.')[:-1])).__dict__.values():
-            if isinstance(obj, type) and issubclass(obj, Plugin) and obj.name != 'Trivial Plugin':
-                plugin_classes.append(obj)
+        # the parent package is always imported before this module
+        parent = __name__.rpartition('.')[0]
+        parent = sys.modules.get(parent) or __import__(parent, fromlist=['*'])
         
-        plugin_classes.sort(key=lambda c:(getattr(c, '__module__', None) or '').count('.'))
-        PLUGIN_CLASSE = plugin_classes[0]
+        # the plugin can declare its main class with PLUGIN_CLASSE = MyPlugin
+        # in the package containing common_utils, else it is searched
+        PLUGIN_CLASSE = getattr(parent, 'PLUGIN_CLASSE', None)
+        if not PLUGIN_CLASSE:
+            plugin_classes = [
+                obj for obj in vars(parent).values()
+                if isinstance(obj, type) and issubclass(obj, Plugin) and obj.name != 'Trivial Plugin'
+            ]
+            PLUGIN_CLASSE = min(plugin_classes, key=lambda c:(getattr(c, '__module__', None) or '').count('.'))
     
     return getattr(PLUGIN_CLASSE, name, default)
 
@@ -85,32 +95,36 @@ def debug_print(*args, **kw):
     flush: flush buffer
     """
     
-    if DEBUG:
-        pre = kw.get('pre', DEBUG_PRE)
-        time_format = kw.get('time', None)
-        if time_format:
-            if not isinstance(time_format, str):
-                time_format = '.2f'
-            try:
-                time_format = (monotonic()-BASE_TIME).__format__(time_format)
-            except:
-                time_format = (monotonic()-BASE_TIME).__format__('.2f')
-            time_format =  f'[{time_format}]'
+    pre = kw.get('pre', DEBUG_PRE)
+    time_format = kw.get('time', None)
+    if time_format:
+        if not isinstance(time_format, str):
+            time_format = '.2f'
+        try:
+            time_format = (monotonic()-BASE_TIME).__format__(time_format)
+        except:
+            time_format = (monotonic()-BASE_TIME).__format__('.2f')
+        time_format =  f'[{time_format}]'
+    
+    if pre or time_format:
+        if pre and time_format:
+            pre = f'{time_format} {pre}'
         
-        if pre or time_format:
-            if pre and time_format:
-                pre = f'{time_format} {pre}'
-            
-            if pre:
-                if not pre.endswith(':'):
-                    pre = pre+':'
-            else:
-                pre = time_format+' '
-            
-            prints(pre, *args, **kw)
+        if pre:
+            if not pre.endswith(':'):
+                pre = pre+':'
         else:
-            prints(*args, **kw)
-        #prints(DEBUG_PRE,'[{:.2f}]'.format(monotonic()-BASE_TIME),':', *args, **kw)
+            pre = time_format+' '
+        
+        prints(pre, *args, **kw)
+    else:
+        prints(*args, **kw)
+    #prints(DEBUG_PRE,'[{:.2f}]'.format(monotonic()-BASE_TIME),':', *args, **kw)
+
+if not DEBUG:
+    # outside of the calibre debug mode, the calls do nothing
+    def debug_print(*args, **kw):
+        pass
 
 
 # ----------------------------------------------
@@ -119,21 +133,42 @@ def debug_print(*args, **kw):
 
 THEME_COLOR = ['', 'dark', 'light']
 
+THEME_NAME = None
 def get_theme_name() -> str:
     """Get the theme color of Calibre"""
-    if CALIBRE_VERSION >= (6,0,0):
-        return THEME_COLOR[1] if QApplication.instance().is_dark_theme else THEME_COLOR[2]
-    return THEME_COLOR[0]
+    global THEME_NAME
+    if THEME_NAME is None:
+        if CALIBRE_VERSION >= (6,0,0):
+            THEME_NAME = THEME_COLOR[1] if QApplication.instance().is_dark_theme else THEME_COLOR[2]
+        else:
+            THEME_NAME = THEME_COLOR[0]
+    return THEME_NAME
+
+def _on_palette_changed():
+    """Reset the cached values that depend of the theme"""
+    global THEME_NAME
+    THEME_NAME = None
+    # the icons of the previous theme will not be used again
+    if _PLUGIN_RESOURCES is not None:
+        _PLUGIN_RESOURCES.ICONS.clear()
+    _MISSING_PIXMAPS.clear()
+
+# calibre 6 emit palette_changed when switching between the light and dark theme
+if hasattr(QApplication.instance(), 'palette_changed'):
+    QApplication.instance().palette_changed.connect(_on_palette_changed)
 
 def linux(path: str) -> str:
     return path.replace('\\', '/')
 
-def get_icon_themed_names(icon_name) -> List[str]:
+def get_icon_themed_names(icon_name) -> Tuple[str, ...]:
     # images/<icon_name>-for-dark-theme.png
     # images/dark/<icon_name>.png
     # images/<icon_name>.png
+    return _icon_themed_names(icon_name, get_theme_name())
+
+@lru_cache(maxsize=256)
+def _icon_themed_names(icon_name: str, theme_name: str) -> Tuple[str, ...]:
     rslt = []
-    theme_name = get_theme_name()
     if theme_name:
         path, ext = os.path.splitext(linux(icon_name).strip('/'))
         name = os.path.basename(path)
@@ -142,7 +177,14 @@ def get_icon_themed_names(icon_name) -> List[str]:
         rslt.append(f'{dir}/{theme_name}/{name}{ext}')
     
     rslt.append(icon_name)
-    return rslt
+    return tuple(rslt)
+
+# the decoded pixmaps of the plugin are stored in the application wide QPixmapCache (in KiB)
+if QPixmapCache.cacheLimit() < 20480:
+    QPixmapCache.setCacheLimit(20480)
+
+# keys of the plugin icons not found in the user resources or the plugin zip
+_MISSING_PIXMAPS = set()
 
 if not hasattr(QIcon, 'ic'):
     QIcon.ic = lambda x: QIcon(I(x))
@@ -162,12 +204,13 @@ def get_icon(icon_name: str) -> QIcon:
             # We know this is definitely not an icon belonging to this plugin
             return QIcon.ic(icon_name)
         
-        rslt = PLUGIN_RESOURCES.ICONS.get(icon_name, None)
+        key = (get_theme_name(), icon_name)
+        rslt = get_plugin_resources().ICONS.get(key, None)
         if not rslt:
             pixmap = get_pixmap(icon_name)
             if pixmap:
                 rslt = QIcon(pixmap)
-                PLUGIN_RESOURCES.ICONS[icon_name] = rslt
+                get_plugin_resources().ICONS[key] = rslt
         
         if rslt:
             return rslt
@@ -201,28 +244,41 @@ def get_pixmap(icon_name: str) -> QPixmap:
             # We know this is definitely not an icon belonging to this plugin
             return from_resources(icon_name)
         
-        rslt = PLUGIN_RESOURCES.PIXMAP.get(icon_name, None)
-        if not rslt:
+        key = f'{PLUGIN_NAME}:{get_theme_name()}:{icon_name}'
+        if key in _MISSING_PIXMAPS:
+            return None
+        rslt = QPixmapCache.find(key)
+        if rslt is None or rslt.isNull():
             # test user overide
             rslt = from_resources(os.path.join(PLUGIN_NAME, icon_name.split('/', 1)[-1]))
             if not rslt:
                 # inside plugin ZIP
+                resources = get_plugin_resources()
                 for name in get_icon_themed_names(icon_name):
-                    if name in PLUGIN_RESOURCES:
+                    if name in resources:
                         rslt = QPixmap()
-                        rslt.loadFromData(PLUGIN_RESOURCES[name])
+                        rslt.loadFromData(resources[name])
+                        # the decoded pixmap is cached, don't keep the raw data too
+                        # (it is read again from the zip if the pixmap is evicted)
+                        resources.pop(name, None)
                         break
             
             if rslt:
-                PLUGIN_RESOURCES.PIXMAP[icon_name] = rslt
+                QPixmapCache.insert(key, rslt)
+            else:
+                # don't search again the icons that don't exist
+                _MISSING_PIXMAPS.add(key)
         
         if rslt:
             return rslt
 
+@lru_cache(maxsize=128)
 def local_resource(*subfolders: Optional[List[str]]) -> str:
     """
     Returns a path to the user's local resources folder
     If a subfolder name parameter is specified, appends this to the path
+    
+    config_dir don't change during the session, so the paths are cached
     """
     
     rslt = os.path.join(config_dir, 'resources', *[f.replace('/','-').replace('\\','-') for f in subfolders])
@@ -237,7 +293,12 @@ def _class_name(obj, inside) -> str:
     return obj.__name__+'('+inside+')'
 
 class PathDict(dict):
-    'dict than contain only path string as keys'
+    """
+    dict than contain only path string as keys
+    
+    The keys are normalized when stored, so a lookup with a normalized key
+    is done directly by the dict. The key is normalized only on a miss.
+    """
     
     def _k(self, __key):
         if not isinstance(__key, str):
@@ -247,42 +308,48 @@ class PathDict(dict):
         return linux(__key)
     
     def __contains__(self, __key: str) -> bool:
-        return dict.__contains__(self, self._k(__key))
+        return dict.__contains__(self, __key) or dict.__contains__(self, self._k(__key))
     
     def __setitem__(self, __key: str, __value):
         return dict.__setitem__(self, self._k(__key), __value)
     
-    def __getitem__(self, __key: str) -> Any:
-        return dict.__getitem__(self, self._k(__key))
+    def __missing__(self, __key: str) -> Any:
+        key = self._k(__key)
+        if key != __key and dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        raise KeyError(__key)
     
     def __delitem__(self, __key):
         return dict.__delitem__(self, self._k(__key))
     
-    def get(self, __key, __default) -> Any:
+    def get(self, __key, __default=None) -> Any:
+        if dict.__contains__(self, __key):
+            return dict.__getitem__(self, __key)
         return dict.get(self, self._k(__key), __default)
     
     def pop(self, __key, __default: Any=Any) -> Any:
-        if __key in self:
-            return dict.pop(__key)
-        if __default == Any:
-            raise KeyError(__key)
-        else:
-            return __default
+        key = self._k(__key)
+        if __default is Any:
+            return dict.pop(self, key)
+        return dict.pop(self, key, __default)
 
 class ZipResources(PathDict):
     def __init__(self, zip_path: str, preload_keys: List[str]=None):
         PathDict.__init__(self)
         self.zip_path = linux(zip_path)
+        self._zip_file = None
+        self._zip_shared = False
+        self._zip_lock = threading.Lock()
         self.load_many(preload_keys)
     
-    def __getitem__(self, __key: str) -> Union[bytes, Any]:
-        if __key in self:
-            return PathDict.__getitem__(self, __key)
-        else:
-            data = self.load(__key)
-            if data is None:
-                raise KeyError(__key)
-            return data
+    def __missing__(self, __key: str) -> Union[bytes, Any]:
+        key = self._k(__key)
+        if key != __key and dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        data = self.load(key)
+        if data is None:
+            raise KeyError(__key)
+        return data
     
     def __str__(self):
         return _class_name(self, repr(self.zip_path)+', '+str(list(self.keys())))
@@ -290,36 +357,86 @@ class ZipResources(PathDict):
     def __repr__(self):
         return _class_name(self,'zip_path='+ repr(self.zip_path)+', '+repr(list(self.keys())))
     
+    def _open_zip(self):
+        """
+        Get the ZipFile.
+        In the GUI thread, it is opened once and shared by the successive reads,
+        and closed when the Qt event loop resume, to not keep the file locked.
+        In the other threads, no timer would fire, so _release_zip() close it after the read.
+        Must be called with the _zip_lock acquired.
+        """
+        if self._zip_file is None:
+            from calibre.utils.zipfile import ZipFile
+            self._zip_file = ZipFile(self.zip_path, 'r')
+            app = QApplication.instance()
+            self._zip_shared = app is not None and QThread.currentThread() is app.thread()
+            if self._zip_shared:
+                QTimer.singleShot(0, self.close)
+        return self._zip_file
+    
+    def _release_zip(self):
+        """
+        Close the ZipFile at the end of a read, if it is not shared.
+        Must be called with the _zip_lock acquired.
+        """
+        if self._zip_file is not None and not self._zip_shared:
+            self._zip_file.close()
+            self._zip_file = None
+    
+    def close(self):
+        """Close the shared ZipFile, it will be reopened by the next read"""
+        with self._zip_lock:
+            if self._zip_file is not None:
+                self._zip_file.close()
+                self._zip_file = None
+    
     def load(self, key: str) -> Union[bytes, Any]:
-        return self.load_many([key]).get(key, None)
+        return self.load_many([key]).get(linux(key), None)
     
     def load_many(self, keys: Optional[List[str]]) -> Dict[str, Union[bytes, str]]:
         names = {linux(n) for n in (keys or []) if n}
         rslt = {}
-        from calibre.utils.zipfile import ZipFile
-        with ZipFile(self.zip_path, 'r') as zf:
-            for entry in zf.namelist():
-                if entry in names:
-                    data = zf.read(entry)
+        if not names:
+            return rslt
+        with self._zip_lock:
+            zf = self._open_zip()
+            try:
+                # direct lookup of the requested entries, the index of the zip is a dict
+                for entry in names:
+                    try:
+                        info = zf.getinfo(entry)
+                    except KeyError:
+                        continue
+                    data = zf.read(info)
                     self[entry] = data
                     rslt[entry] = data
+            finally:
+                self._release_zip()
         return rslt
 
 class PluginResources(ZipResources):
     def __init__(self, preload_keys: List[str]=None):
-        from calibre.utils.zipfile import ZipFile
-        ZipResources.__init__(self, PLUGIN_INSTANCE.plugin_path)
-        preload_keys = [linux(k) for k in preload_keys or []]
+        ZipResources.__init__(self, PLUGIN_INSTANCE.plugin_path, preload_keys)
         
-        self.ICONS = PathDict()
-        self.PIXMAP = PathDict()
+        # QIcon by (theme, icon_name), the QPixmap are stored in the QPixmapCache
+        self.ICONS = {}
         
-        with ZipFile(self.zip_path, 'r') as zf:
-            for entry in zf.namelist():
-                if entry in preload_keys:
-                    self.__setitem__(entry, zf.read(entry))
-                if entry.startswith('images/') and os.path.splitext(entry)[1].lower() == '.png':
-                    self.__setitem__(entry, zf.read(entry))
+        # only index the zip, the entries are read on their first access
+        with self._zip_lock:
+            try:
+                self._zip_names = set(self._open_zip().namelist())
+            finally:
+                self._release_zip()
+    
+    def __contains__(self, __key: str) -> bool:
+        return PathDict.__contains__(self, __key) or self._k(__key) in self._zip_names
+    
+    def get(self, __key, __default=None) -> Any:
+        if PathDict.__contains__(self, __key):
+            return PathDict.get(self, __key, __default)
+        if self._k(__key) in self._zip_names:
+            return self[__key]
+        return __default
     
     def __str__(self):
         return _class_name(self, str(list(self.keys())))
@@ -329,7 +446,19 @@ class PluginResources(ZipResources):
 
 # Global definition of our plugin resources. Used to share between the xxxAction and xxxBase
 # classes if you need any zip images to be displayed on the configuration dialog.
-PLUGIN_RESOURCES = PluginResources()
+# Created on the first access, not when importing the module.
+_PLUGIN_RESOURCES = None
+def get_plugin_resources() -> PluginResources:
+    global _PLUGIN_RESOURCES
+    if _PLUGIN_RESOURCES is None:
+        _PLUGIN_RESOURCES = PluginResources()
+    return _PLUGIN_RESOURCES
+
+def __getattr__(name: str) -> Any:
+    # keep "from common_utils import PLUGIN_RESOURCES" working
+    if name == 'PLUGIN_RESOURCES':
+        return get_plugin_resources()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 # ----------------------------------------------
@@ -349,12 +478,12 @@ def truncate_title(title: str, max_length: int=75) -> str:
 def get_image_map(subdir: str=None) -> Dict[str, QIcon]:
     rslt = {}
     resources_dir = os.path.join(config_dir, 'resources', 'images', subdir or '')
-    if os.path.exists(resources_dir):
+    if os.path.isdir(resources_dir):
         # Get the names of any .png images in this directory
-        for f in sorted(os.listdir(resources_dir)):
-            if f.lower().endswith('.png'):
-                name = os.path.basename(f)
-                rslt[linux(name)] = get_icon(name)
+        with os.scandir(resources_dir) as it:
+            names = sorted(e.name for e in it if e.name.lower().endswith('.png') and e.is_file())
+        for name in names:
+            rslt[linux(name)] = get_icon(name)
     
     return rslt
 
@@ -364,36 +493,26 @@ def split_long_text(text: str, max_length: int=70) -> List[str]:
     if text_lenght < max_length+10:
         return [text]
     
-    def split_to_space(src_text: str, lentgh: int) -> Tuple[str, str]:
-        if len(src_text) < lentgh:
-            return src_text, None
-        
-        end = src_text[lentgh:]
-        if ' ' not in end:
-            return src_text, None
-        
-        split_lentgh = lentgh + end.index(' ')
-        return src_text[:split_lentgh], src_text[split_lentgh+1:]
+    def lines_bounds(length: int) -> List[Tuple[int, int]]:
+        # cut at the first space after the length, only the positions are computed
+        rslt = []
+        start = 0
+        while start < text_lenght:
+            end = -1
+            if text_lenght-start >= length:
+                end = text.find(' ', start+length)
+            if end < 0:
+                end = text_lenght
+            rslt.append((start, end))
+            start = end+1
+        return rslt
     
     for spliting in range(2, 11):
-        length_attempt = text_lenght // spliting
-        rslt = []
-        
-        adding_line, next_line = None, text
-        while next_line:
-            adding_line, next_line = split_to_space(next_line, length_attempt)
-            rslt.append(adding_line)
-        
-        to_long = False
-        for l in rslt:
-            if len(l) > max_length:
-                to_long = True
-                break
-        
-        if not to_long:
+        bounds = lines_bounds(text_lenght // spliting)
+        if all(end-start <= max_length for start, end in bounds):
             break
     
-    return rslt
+    return [text[start:end] for start, end in bounds]
 
 def return_line_long_text(text: str, max_length: int=70) -> str:
     return '\n'.join(split_long_text(text=text, max_length=max_length))
@@ -413,7 +532,7 @@ def has_restart_pending(show_warning=True, msg_warning=None) -> bool:
 
 def duplicate_entry(lst: Iterable) -> List:
     'retrieve the entry in double inside a iterable'
-    return list({x for x in lst if lst.count(x) > 1})
+    return [x for x, count in Counter(lst).items() if count > 1]
 
 # Simple Regex
 class regex():
@@ -430,33 +549,43 @@ class regex():
     def __call__(self, flag=None):
         return self.__class__(flag)
     
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _compile(pattern, flag):
+        'compiled pattern, cached apart of the re module cache'
+        return regex._re.compile(pattern, flag)
+    
     def match(self, pattern, string, flag=None):
         flag = flag or self.flag
-        return regex._re.fullmatch(pattern, string, flag)
+        return self._compile(pattern, flag).fullmatch(string)
     
     def search(self, pattern, string, flag=None):
         flag = flag or self.flag
-        return regex._re.search(pattern, string, flag)
+        return self._compile(pattern, flag).search(string)
     
     def searchall(self, pattern, string, flag=None):
         flag = flag or self.flag
-        return regex._re.finditer(pattern, string, flag)
+        return self._compile(pattern, flag).finditer(string)
     
     def split(self, pattern, string, maxsplit=0, flag=None):
         flag = flag or self.flag
-        return regex._re.split(pattern, string, maxsplit, flag)
+        return self._compile(pattern, flag).split(string, maxsplit)
     
     def simple(self, pattern, repl, string, flag=None):
         flag = flag or self.flag
-        return regex._re.sub(pattern, repl, string, 0, flag)
+        return self._compile(pattern, flag).sub(repl, string)
     
     def loop(self, pattern, repl, string, flag=None):
         flag = flag or self.flag
+        compiled = self._compile(pattern, flag)
         i = 0
-        while self.search(pattern, string, flag):
+        while True:
+            # subn give the number of substitutions, no need to search before
+            string, count = compiled.subn(repl, string)
+            if not count:
+                break
             if i > 1000:
                 raise regex.Exception('the pattern and substitution string caused an infinite loop', pattern, repl)
-            string = self.simple(pattern, repl, string, flag)
             i+=1
             
         return string
@@ -472,6 +601,30 @@ class regex():
 regex = regex()
 """Easy Regex"""
 
+_IMMUTABLE_TYPES = (str, int, float, bool, bytes, type(None))
+
+def _copy_value(value: Any) -> Any:
+    """
+    Deep copy of a preference value
+    The immutable values are returned as is, and the dict and list are copied
+    directly, copy.deepcopy() is only used for the other types.
+    """
+    if isinstance(value, _IMMUTABLE_TYPES):
+        return value
+    if type(value) is dict:
+        return {k:_copy_value(v) for k,v in value.items()}
+    if type(value) is list:
+        return [_copy_value(v) for v in value]
+    return copy.deepcopy(value)
+
+def _copy_prefs(prefs: dict, defaults: dict) -> dict:
+    """
+    Deep copy of the preferences, completed by the defaults values
+    """
+    rslt = {k:_copy_value(v) for k,v in prefs.items()}
+    rslt.update({k:_copy_value(v) for k,v in defaults.items() if k not in rslt})
+    return rslt
+
 class PREFS_json(JSONConfig):
     """
     Use plugin name to create a JSONConfig file
@@ -512,9 +665,7 @@ class PREFS_json(JSONConfig):
         """
         get a copy dict of this instance
         """
-        rslt = {copy.deepcopy(k):copy.deepcopy(v) for k,v in self.items()}
-        rslt.update({copy.deepcopy(k):copy.deepcopy(v) for k,v in self.defaults.items() if k not in rslt})
-        return rslt
+        return _copy_prefs(self, self.defaults)
 
 class PREFS_dynamic(DynamicConfig):
     """
@@ -550,26 +701,25 @@ class PREFS_dynamic(DynamicConfig):
         """
         get a copy dict of this instance
         """
-        rslt = {}
-        for k,v in self.items():
-            rslt[copy.deepcopy(k)] = copy.deepcopy(v)
-        
-        for k, v in self.defaults.items():
-            if k not in rslt:
-                rslt[k] = copy.deepcopy(v)
-        return rslt
+        return _copy_prefs(self, self.defaults)
 
 class PREFS_library(dict):
     """
     Create a dictionary of preference stored in the library
     
     Defined a custom namespaced at the root of __init__.py // __init__.PREFS_NAMESPACE
+    
+    To change many values with a single write in the library, use:
+        with prefs:
+            prefs[key1] = val1
+            prefs[key2] = val2
     """
     
     def __init__(self, key='settings', defaults={}):
         dict.__init__(self)
         self._no_commit = False
         self._db = None
+        self._loaded = None
         self.key = key if key else ''
         self.defaults = defaults if defaults else {}
         
@@ -624,36 +774,52 @@ class PREFS_library(dict):
     
     def __delitem__(self, key):
         self.refresh()
-        try:
-            dict.__delitem__(self, key)
-        except KeyError:
-            pass  # ignore missing keys
+        dict.pop(self, key, None)  # ignore missing keys
         self.commit()
     
     def __str__(self):
         self.refresh()
-        return dict.__str__(self.copy())
+        # only displayed, no need of a deep copy
+        rslt = dict(self)
+        rslt.update((k,v) for k,v in self.defaults.items() if k not in rslt)
+        return dict.__str__(rslt)
     
     def _check_db(self):
-        if current_db() and self._db != current_db():
-            self._db = current_db()
+        db = current_db()
+        if db and self._db != db:
+            self._db = db
         return self._db is not None
     
     def refresh(self):
+        if self._no_commit:
+            # inside a "with" block, keep the pending changes until the commit
+            return
         if self._check_db():
-            rslt = self._db.prefs.get_namespaced(self.namespace, self.key, {})
-            self._no_commit = True
-            self.clear()
-            self.update(rslt)
-            self._no_commit = False
+            rslt = self._db.prefs.get_namespaced(self.namespace, self.key, None)
+            # the value stored in the library is replaced on each change,
+            # the same object from the same library mean there is nothing to reload
+            if self._loaded and self._loaded[0] is self._db and self._loaded[1] is rslt:
+                return
+            self._load(rslt)
+    
+    def _load(self, rslt):
+        self._loaded = (self._db, rslt)
+        
+        no_commit = self._no_commit
+        self._no_commit = True
+        self.clear()
+        self.update(rslt or {})
+        self._no_commit = no_commit
     
     def commit(self):
         if self._no_commit:
             return
         
         if self._check_db():
-            self._db.prefs.set_namespaced(self.namespace, self.key, self.copy())
-            self.refresh()
+            rslt = self.copy()
+            self._db.prefs.set_namespaced(self.namespace, self.key, rslt)
+            # load what was written, without reading it back from the library
+            self._load(rslt)
     
     def __enter__(self):
         self.refresh()
@@ -675,6 +841,4 @@ class PREFS_library(dict):
         """
         get a copy dict of this instance
         """
-        rslt = {copy.deepcopy(k):copy.deepcopy(v) for k,v in self.items()}
-        rslt.update({copy.deepcopy(k):copy.deepcopy(v) for k,v in self.defaults.items() if k not in rslt})
-        return rslt
+        return _copy_prefs(self, self.defaults)
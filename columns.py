@@ -9,10 +9,9 @@ try:
 except NameError:
     pass  # load_translations() added in calibre 1.9
 
-import copy
 import os
 import sys
-from typing import Callable, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from calibre import prints
 from calibre.constants import numeric_version as CALIBRE_VERSION
@@ -24,13 +23,6 @@ def current_db() -> LibraryDatabase:
     from calibre.gui2.ui import get_gui
     return getattr(get_gui(),'current_db', None)
 
-class typeproperty(property):
-    registry = []
-    
-    def __init__(self, func):
-        property.__init__(self, fget=func)
-        typeproperty.registry.append(func)
-
 def get_all_identifiers() -> List[str]:
     'Get the identifiers in the library'
     return current_db().get_all_identifier_types()
@@ -57,6 +49,9 @@ def is_enum_value(name, value) -> bool:
     else:
         return True
 
+_BOOL_TRUE = frozenset(['yes','y','true','1'])
+_BOOL_FALSE = frozenset(['no','n','false','0'])
+
 def is_bool_value(value: str) -> bool:
     """
     Test if the value is considered as a boulean by Calibre
@@ -67,9 +62,10 @@ def is_bool_value(value: str) -> bool:
     return: True / False / raise Error
     """
     
-    if str(value).lower() in ['yes','y','true','1']:
+    lower = str(value).lower()
+    if lower in _BOOL_TRUE:
         return True
-    elif str(value).lower() in ['no','n','false','0']:
+    elif lower in _BOOL_FALSE:
         return False
     else:
         raise ValueError(f'\'{value}\' is not considered as a boulean by Calibre')
@@ -102,17 +98,20 @@ class MutipleValue(dict):
         self.update(data)
     
     def __repr__(self):
-        return self.__class__.__name__ +'('+ repr(self._data)[1:-1]+')'
+        return self.__class__.__name__ +'('+ dict.__repr__(self)[1:-1]+')'
     
     @property
     def ui_to_list(self) -> str:
-        return self._data.get('ui_to_list', None)
+        return self.get('ui_to_list', None)
     @property
     def list_to_ui(self) -> str:
-        return self._data.get('list_to_ui', None)
+        return self.get('list_to_ui', None)
     @property
     def cache_to_list(self) -> str:
-        return self._data.get('cache_to_list', None)
+        return self.get('cache_to_list', None)
+
+# built-in fields stored as text, but that are not a text column
+_NON_TEXT_LABELS = frozenset(['comments', 'title'])
 
 class ColumnMetadata():
     """
@@ -176,30 +175,100 @@ class ColumnMetadata():
         
         _is_comments
         _is_news
+    
+    The metadata dict is not copied, and must not be modified.
     """
     
+    # the instances are kept in the cache of the library columns
+    __slots__ = (
+        'metadata', '_custom', 'label', 'datatype', 'display', '_src_is_custom',
+        'is_composite', 'name', '_multiple', '_type',
+    )
+    
     def __init__(self, metadata, is_custom=True):
-        self.metadata = copy.deepcopy(metadata)
+        # the metadata is only read, no need of a copy
+        self.metadata = metadata
         self._custom = is_custom
         
-        self._multiple = self.metadata['is_multiple']
+        # the values read the most often are stored once
+        self.label = metadata.get('label', None)
+        self.datatype = metadata.get('datatype', None)
+        self.display = metadata.get('display', None)
+        self._src_is_custom = metadata.get('is_custom', None)
+        # the custom series index are not marked as custom a internal bool is nesecary
+        self.is_composite = self.datatype == 'composite'
+        if self._custom:
+            self.name = '#' + self.label
+        elif self.label == 'sort':
+            self.name = 'title_sort'
+        else:
+            self.name = self.label
+        
+        # most of the columns are not multiple, the MutipleValue is only created when needed
+        self._multiple = None
         if self.is_csp:
             self._multiple = MutipleValue({'ui_to_list': ',', 'list_to_ui': ', ', 'cache_to_list': ','})
-        if self._multiple:
-            self._multiple = MutipleValue(self._multiple)
-        else:
-            self._multiple = None
+        elif metadata.get('is_multiple', None):
+            self._multiple = MutipleValue(metadata['is_multiple'])
         
-        self._type = None
-        for func in typeproperty.registry:
-            if func.__call__(self):
-                self._type = func.__name__.split('_is_', 1)[-1]
+        self._type = self._get_type(
+            self.label, self.datatype, self.display, self.is_multiple, self.is_csp, self._src_is_custom,
+        )
         
         if not self._type:
             prints('common_utils.columns.py', self.name)
             prints('common_utils.columns.py', 'metadata', self.metadata)
             raise TypeError('Invalide Column metadata.')
     
+    @staticmethod
+    def _get_type(label, datatype, display, is_multiple, is_csp, src_is_custom) -> Optional[str]:
+        """
+        Identify the type of the column in a single pass.
+        Same result as the _is_xxx properties, tested from the most specific to the most generic type.
+        """
+        interpret_as = display.get('interpret_as', None)
+        is_comments = label == 'comments' or datatype == 'comments' and interpret_as != 'short-text'
+        
+        if label == 'news':
+            return ColumnTypes.news
+        if is_csp:
+            return ColumnTypes.identifiers
+        if datatype == 'composite':
+            return ColumnTypes.composite_text if is_multiple else ColumnTypes.composite_tag
+        if is_comments and interpret_as == 'long-text':
+            return ColumnTypes.long_text
+        if is_comments and interpret_as == 'markdown':
+            return ColumnTypes.markdown
+        if label == 'comments' or is_comments and interpret_as == 'html':
+            return ColumnTypes.html
+        if datatype == 'enumeration':
+            return ColumnTypes.enumeration
+        if datatype == 'bool':
+            return ColumnTypes.bool
+        if datatype == 'rating':
+            return ColumnTypes.rating
+        if datatype == 'datetime':
+            return ColumnTypes.datetime
+        if label == 'cover':
+            return ColumnTypes.cover
+        if datatype == 'int':
+            return ColumnTypes.integer
+        if label == 'series_index' or datatype == 'float' and not src_is_custom and label != 'size':
+            return ColumnTypes.series_index
+        if label == 'size' or datatype == 'float' and src_is_custom:
+            return ColumnTypes.float
+        if datatype == 'series':
+            return ColumnTypes.series
+        if datatype == 'text' and not is_multiple and label not in _NON_TEXT_LABELS:
+            return ColumnTypes.text
+        if label == 'title' or datatype == 'comments' and interpret_as == 'short-text':
+            return ColumnTypes.title
+        if datatype == 'text' and is_multiple or label in ('authors', 'tags'):
+            if label == 'authors' or label != 'tags' and display.get('is_names', False):
+                return ColumnTypes.names
+            return ColumnTypes.tags
+        return None
+    
     def __repr__(self):
         #<calibre_plugins. __module__ .common_utils.ColumnMetadata instance at 0x1148C4B8>
         #''.join(['<', str(self.__class__), ' instance at ', hex(id(self)),'>'])
@@ -260,14 +329,6 @@ class ColumnMetadata():
     
     # type property
     @property
-    def name(self) -> str:
-        if self._custom:
-            return '#' + self.label
-        else:
-            if self.label == 'sort':
-                return 'title_sort'
-            return self.label
-    @property
     def display_name(self) -> str:
         return self.metadata.get('name', None)
     @property
@@ -277,56 +338,54 @@ class ColumnMetadata():
     def type(self) -> str:
         return self._type
     
-    @typeproperty
+    @property
     def _is_names(self) -> bool:
         return bool(self.label == 'authors' or self.datatype == 'text' and self.is_multiple and self.display.get('is_names', False))
-    @typeproperty
+    @property
     def _is_tags(self) -> bool:
         return bool(self.label == 'tags' or self.datatype == 'text' and self.is_multiple and not (self.label == 'authors' or self.display.get('is_names', False) or self.is_csp))
     
-    @typeproperty
+    @property
     def _is_title(self) -> bool:
         return bool(self.label == 'title' or self.datatype == 'comments' and self.display.get('interpret_as', None) == 'short-text')
     
-    @typeproperty
+    @property
     def _is_text(self) -> bool:
-        return bool(self.label not in ['comments', 'title'] and self.datatype == 'text' and not self.is_multiple)
+        return bool(self.label not in _NON_TEXT_LABELS and self.datatype == 'text' and not self.is_multiple)
     
-    @typeproperty
+    @property
     def _is_series(self) -> bool:
         return bool(self.datatype == 'series')
-    @typeproperty
+    @property
     def _is_float(self) -> bool:
         return bool(self.label == 'size' or self.datatype == 'float' and self._src_is_custom and self.label != 'series_index')
-    @typeproperty
+    @property
     def _is_series_index(self) -> bool:
         return bool(self.label == 'series_index' or self.datatype == 'float' and not self._src_is_custom and self.label != 'size')
     
-    @typeproperty
+    @property
     def _is_integer(self) -> bool:
         return bool(self.datatype == 'int' and self.label != 'cover')
-    @typeproperty
+    @property
     def _is_cover(self) -> bool:
         return bool(self.label == 'cover')
-    @typeproperty
+    @property
     def _is_datetime(self) -> bool:
         return bool(self.datatype == 'datetime')
-    @typeproperty
+    @property
     def _is_rating(self) -> bool:
         return bool(self.datatype == 'rating')
-    @typeproperty
+    @property
     def _is_bool(self) -> bool:
         return bool(self.datatype == 'bool')
-    @typeproperty
+    @property
     def _is_enumeration(self) -> bool:
         return bool(self.datatype == 'enumeration')
     
     @property
     def enum_values(self) -> List[str]:
         if self._is_enumeration:
-            rslt = self.display.get('enum_values', [])
-            rslt.insert(0, '')
-            return rslt
+            return [''] + self.display.get('enum_values', [])
         else:
             return None
     @property
@@ -339,30 +398,27 @@ class ColumnMetadata():
     @property
     def _is_comments(self) -> bool:
         return bool(self.label == 'comments' or self.datatype == 'comments' and self.display.get('interpret_as', None) != 'short-text')
-    @typeproperty
+    @property
     def _is_html(self) -> bool:
         return bool(self.label == 'comments' or self._is_comments and self.display.get('interpret_as', None) == 'html')
-    @typeproperty
+    @property
     def _is_markdown(self) -> bool:
         return bool(self._is_comments and self.display.get('interpret_as', None) == 'markdown')
-    @typeproperty
+    @property
     def _is_long_text(self) -> bool:
         return bool(self._is_comments and self.display.get('interpret_as', None)== 'long-text')
     
     @property
-    def is_composite(self) -> bool:
-        return bool(self.datatype == 'composite')
-    @typeproperty
     def _is_composite_text(self) -> bool:
         return bool(self.is_composite and self.is_multiple)
-    @typeproperty
+    @property
     def _is_composite_tag(self) -> bool:
         return bool(self.is_composite and not self.is_multiple)
     
-    @typeproperty
+    @property
     def _is_identifiers(self) -> bool:
         return bool(self.is_csp)
-    @typeproperty
+    @property
     def _is_news(self) -> bool:
         return bool(self.label == 'news')
     #
@@ -428,32 +484,18 @@ class ColumnMetadata():
     def column(self) -> str:
         return self.metadata.get('column', None)
     @property
-    def datatype(self) -> str:
-        return self.metadata.get('datatype', None)
-    @property
     def kind(self) -> str:
         return self.metadata.get('kind', None)
     @property
     def search_terms(self) -> str:
         return self.metadata.get('search_terms', None)
     @property
-    def label(self) -> str:
-        return self.metadata.get('label', None)
-    @property
     def colnum(self) -> int:
         return self.metadata.get('colnum', None)
     @property
-    def display(self) -> str:
-        return self.metadata.get('display', None)
-    @property
     def is_custom(self) -> bool:
         return self._custom
     @property
-    def _src_is_custom(self) -> str:
-        return self.metadata.get('is_custom', None)
-        # the custom series index are not marked as custom a internal bool is nesecary
-    
-    @property
     def is_category(self) -> bool:
         return self.metadata.get('is_category', False)
     @property
@@ -516,21 +558,18 @@ def get_all_columns(only_custom: Optional[bool]=None, include_composite: Optiona
 
 def get_column_from_name(name: str) -> ColumnMetadata:
     'Get the column with the specified name, else None'
-    def predicate(column: ColumnMetadata):
-        return column.name == name
-    for v in get_columns_where(predicate).values():
-        return v
+    db = current_db()
+    if db:
+        return _get_library_columns(db.field_metadata)[0].get(name, None)
     return None
 
 
 def _get_columns_type(type, only_custom: Optional[bool]=None) -> Dict[str, ColumnMetadata]:
-    def predicate(column: ColumnMetadata):
-        if type == column.type:
-            return _test_is_custom(column, only_custom)
-        else:
-            return False
-    
-    return get_columns_where(predicate)
+    db = current_db()
+    if db:
+        columns = _get_library_columns(db.field_metadata)[1].get(type, {})
+        return {k:cm for k,cm in columns.items() if _test_is_custom(cm, only_custom)}
+    return {}
 
 def get_categories(only_custom: Optional[bool]=None, include_composite: Optional[bool]=None) -> Dict[str, ColumnMetadata]:
     def predicate(column: ColumnMetadata):
@@ -669,14 +708,20 @@ def get_composite_tag(only_custom: Optional[bool]=None) -> Dict[str, ColumnMetad
     return _get_columns_type(ColumnTypes.composite_tag, only_custom)
 
 
+_EXCLUDED_FIELDS = frozenset(['id' , 'au_map', 'timestamp', 'formats', 'ondevice', 'news', 'series_sort', 'path', 'in_tag_browser'])
+
 def get_possible_fields() -> Tuple[List[str], List[str]]:
     """
     Get the fields of the current library
     
     return: all_fields, writable_fields
     """
+    all_fields, writable_fields = _get_library_result('possible_fields', _get_possible_fields)
+    return list(all_fields), list(writable_fields)
+
+def _get_possible_fields() -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
     def predicate(column):
-        if column.name not in ['id' , 'au_map', 'timestamp', 'formats', 'ondevice', 'news', 'series_sort', 'path', 'in_tag_browser'] and column.type:
+        if column.name not in _EXCLUDED_FIELDS and column.type:
             return True
         else:
             return False
@@ -688,7 +733,7 @@ def get_possible_fields() -> Tuple[List[str], List[str]]:
     all_fields.insert(0, '{template}')
     writable_fields = [cc.name for cc in columns.values() if not cc.is_composite]
     writable_fields.sort()
-    return all_fields, writable_fields
+    return tuple(all_fields), tuple(writable_fields)
 
 def get_possible_columns() -> List[str]:
     """
@@ -696,29 +741,67 @@ def get_possible_columns() -> List[str]:
     
     return: list(str)
     """
-    standard = ['title', 'authors', 'tags', 'series', 'publisher', 'pubdate', 'rating', 'languages', 'last_modified', 'timestamp', 'comments', 'author_sort', 'title_sort', 'marked']
-    if CALIBRE_VERSION >= (6,17,0):
-        standard += ['id', 'path']
-    
+    return list(_get_library_result('possible_columns', _get_possible_columns))
+
+_STANDARD_COLUMNS = ('title', 'authors', 'tags', 'series', 'publisher', 'pubdate', 'rating', 'languages', 'last_modified', 'timestamp', 'comments', 'author_sort', 'title_sort', 'marked')
+if CALIBRE_VERSION >= (6,17,0):
+    _STANDARD_COLUMNS += ('id', 'path')
+
+def _get_possible_columns() -> Tuple[str, ...]:
     def predicate(column):
         if column.is_custom and not (column.is_composite or column._is_series_index):
             return True
         else:
             return False
     
-    return standard + sorted(get_columns_where(predicate).keys())
+    return _STANDARD_COLUMNS + tuple(sorted(get_columns_where(predicate).keys()))
 
 def get_columns_from_dict(src_dict: FieldMetadata, predicate=None) -> Dict[str, ColumnMetadata]:
     'Convert a FieldMetadata dict to a ColumnMetadata dict'
-    def _predicate(column: ColumnMetadata):
-        return True
-    predicate = predicate or _predicate
-    return {cm.name:cm for cm in [ColumnMetadata(fm, k.startswith('#')) for k,fm in src_dict.items() if fm.get('label', None)] if predicate(cm)}
+    rslt = {}
+    for k,fm in src_dict.items():
+        if not fm.get('label', None):
+            continue
+        cm = ColumnMetadata(fm, k.startswith('#'))
+        if not predicate or predicate(cm):
+            rslt[cm.name] = cm
+    return rslt
+
+_COLUMNS_CACHE = None
+def _get_library_columns(field_metadata: FieldMetadata) -> Tuple[Dict[str, ColumnMetadata], Dict[str, Dict[str, ColumnMetadata]], dict]:
+    """
+    Get all the ColumnMetadata of a FieldMetadata, by name and by type,
+    and a dict to store the results computed from these columns.
+    They are built once, and rebuilt when the library or its fields change
+    """
+    global _COLUMNS_CACHE
+    keys = tuple(field_metadata.keys())
+    if not (_COLUMNS_CACHE and _COLUMNS_CACHE[0] is field_metadata and _COLUMNS_CACHE[1] == keys):
+        columns = get_columns_from_dict(field_metadata)
+        by_type = {}
+        for name, cm in columns.items():
+            by_type.setdefault(cm.type, {})[name] = cm
+        _COLUMNS_CACHE = (field_metadata, keys, columns, by_type, {})
+    return _COLUMNS_CACHE[2:]
+
+def _get_library_result(name: str, func: Callable[[], Any]) -> Any:
+    'Get the result of func for the current library, computed again only when its columns change'
+    db = current_db()
+    if not db:
+        return func()
+    results = _get_library_columns(db.field_metadata)[2]
+    if name not in results:
+        results[name] = func()
+    return results[name]
 
 def get_columns_where(predicate: Callable[[ColumnMetadata], bool]=None) -> Dict[str, ColumnMetadata]:
     'Get ColumnMetadata of the currend library'
-    if current_db():
-        return get_columns_from_dict(current_db().field_metadata, predicate)
+    db = current_db()
+    if db:
+        columns = _get_library_columns(db.field_metadata)[0]
+        if predicate:
+            return {k:cm for k,cm in columns.items() if predicate(cm)}
+        return dict(columns)
     else:
         return {}
 
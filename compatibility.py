@@ -16,19 +16,27 @@ except:
         # by get_categories, which is in the default order
         cat_ord = []
         all_cat_set = frozenset(all_cats)
+        # Split the standard and non-standard categories in a single pass
+        standard_cats = []
+        other_cats = []
+        for key in all_cats:
+            if is_standard_category(key):
+                standard_cats.append(key)
+            else:
+                other_cats.append(key)
         # Do the standard categories first
         # Verify all the columns in ordered_cats are actually in all_cats
         for key in ordered_cats:
-            if is_standard_category(key) and key in all_cat_set:
+            if key in all_cat_set and is_standard_category(key):
                 cat_ord.append(key)
         # Add any new standard cats at the end of the list
-        for key in all_cats:
-            if key not in cat_ord and is_standard_category(key):
+        cat_ord_set = set(cat_ord)
+        for key in standard_cats:
+            if key not in cat_ord_set:
                 cat_ord.append(key)
+                cat_ord_set.add(key)
         # Now add the non-standard cats (user cats and search)
-        for key in all_cats:
-            if not is_standard_category(key):
-                cat_ord.append(key)
+        cat_ord.extend(other_cats)
         return cat_ord
 
 try: